@@ -2,12 +2,22 @@
 """FastAPI application exposing the /ask endpoint."""
 from __future__ import annotations
 
+import asyncio
+import os
+
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
 
-from src.qaservice import config
+from src.qaservice import config, embedding
 from src.qaservice.service import QAService
 
+# With QA_PRELOAD_MODEL=1 the embedding model loads at import time, so a
+# pre-fork server (gunicorn --preload) shares one copy of the weights across
+# all workers instead of loading ~90 MB per process.
+if os.environ.get("QA_PRELOAD_MODEL") == "1":
+    embedding.preload()
+
 
 class AskRequest(BaseModel):
     q: str = Field(..., description="Natural language question")
@@ -36,7 +46,11 @@ class AskResponse(BaseModel):
     mode: str
 
 
-app = FastAPI(title="Industrial Safety QA Service", version="1.0.0")
+app = FastAPI(
+    title="Industrial Safety QA Service",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+)
 _service: QAService | None = None
 
 
@@ -47,12 +61,21 @@ def get_service() -> QAService:
     return _service
 
 
+@app.on_event("startup")
+def warmup() -> None:
+    # Build the service and touch the model + index once, so cold-start
+    # costs land at boot instead of inside the first request's latency.
+    get_service().warmup()
+
+
 @app.post("/ask", response_model=AskResponse)
-def ask(request: AskRequest) -> AskResponse:
+async def ask(request: AskRequest) -> AskResponse:
     question = request.q.strip()
     if not question:
         raise HTTPException(status_code=400, detail="Question cannot be empty")
-    payload = get_service().ask(question, request.k, request.mode)
+    # Retrieval and encoding are blocking; run them on a worker thread so the
+    # event loop keeps accepting requests while one is in flight.
+    payload = await asyncio.to_thread(get_service().ask, question, request.k, request.mode)
     return AskResponse(**payload)
 
 
@@ -0,0 +1,24 @@
+"""Exact top-k scoring kernel for the rerank stage."""
+from __future__ import annotations
+
+from typing import Tuple
+
+import numpy as np
+
+
+def topk_cosine(query: np.ndarray, matrix: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return (row indices, scores) of the ``k`` best rows of ``matrix``.
+
+    Both inputs are expected unit-normalized float32, so the dot product is
+    cosine similarity. The matmul runs as one BLAS gemv over the contiguous
+    candidate matrix and argpartition keeps selection O(n) rather than
+    sorting the whole shortlist; only the final k entries are sorted.
+    """
+    if matrix.size == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    scores = matrix @ np.asarray(query, dtype=np.float32)
+    k = min(k, scores.shape[0])
+    top = np.argpartition(-scores, k - 1)[:k]
+    order = top[np.argsort(-scores[top])]
+    return order, scores[order]
@@ -2,7 +2,8 @@
 from __future__ import annotations
 
 import re
-from typing import Iterable, List, Optional, Tuple
+from functools import lru_cache
+from typing import List, Optional, Tuple
 
 from . import config
 from .search import SearchResult
@@ -10,33 +11,43 @@ from .search import SearchResult
 WORD_RE = re.compile(r"[A-Za-z0-9]{3,}")
 
 
-def _question_terms(question: str) -> List[str]:
-    return [w.lower() for w in WORD_RE.findall(question)]
+@lru_cache(maxsize=config.QUERY_CACHE_SIZE)
+def _question_terms(question: str) -> Tuple[str, ...]:
+    return tuple(w.lower() for w in WORD_RE.findall(question))
 
 
 def _normalise_text(text: str) -> str:
     return text.encode("ascii", "ignore").decode("ascii")
 
 
-def _best_snippet(text: str, terms: Iterable[str], max_words: int = 30) -> str:
+@lru_cache(maxsize=config.QUERY_CACHE_SIZE)
+def _terms_pattern(terms: Tuple[str, ...]) -> Optional[re.Pattern[str]]:
+    """Compile all question terms into one alternation.
+
+    A single compiled pattern finds the earliest occurrence of any term in
+    one C-level scan, instead of one full str.find pass per term. Longer
+    terms come first so overlapping alternatives prefer the longer match.
+    """
+    escaped = sorted((re.escape(t) for t in terms), key=len, reverse=True)
+    if not escaped:
+        return None
+    return re.compile("|".join(escaped))
+
+
+def _best_snippet(text: str, pattern: Optional[re.Pattern[str]], max_words: int = 30) -> str:
     cleaned = _normalise_text(text)
-    lowered = cleaned.lower()
-    best_index = None
-    for term in terms:
-        idx = lowered.find(term)
-        if idx != -1 and (best_index is None or idx < best_index):
-            best_index = idx
-    if best_index is None:
+    match = pattern.search(cleaned.lower()) if pattern is not None else None
+    if match is None:
         snippet = cleaned
     else:
+        best_index = match.start()
         start = max(0, best_index - 80)
         end = min(len(cleaned), best_index + 220)
         snippet = cleaned[start:end]
-    snippet = re.sub(r"\s+", " ", snippet).strip()
     words = snippet.split()
     if len(words) > max_words:
-        snippet = " ".join(words[:max_words]) + "..."
-    return snippet
+        return " ".join(words[:max_words]) + "..."
+    return " ".join(words)
 
 
 def build_answer(question: str, results: List[SearchResult]) -> Tuple[Optional[str], List[dict]]:
@@ -62,11 +73,11 @@ def build_answer(question: str, results: List[SearchResult]) -> Tuple[Optional[s
     if top_score < config.ABSTAIN_THRESHOLD:
         return None, contexts
 
-    terms = _question_terms(question)
+    pattern = _terms_pattern(_question_terms(question))
     snippets: List[str] = []
     citations: List[str] = []
     for res in results[:2]:
-        snippet = _best_snippet(res.text, terms)
+        snippet = _best_snippet(res.text, pattern)
         if snippet:
             snippets.append(snippet)
             citation = f"[{res.source_title}, chunk {res.chunk_index}]"
@@ -34,26 +34,28 @@ def chunk_paragraphs(
     if not paragraphs:
         return
 
+    # current_len tracks len(" ".join(buffer)) incrementally so the buffer is
+    # only joined when a chunk is actually emitted; re-joining on every
+    # appended paragraph made this loop quadratic for long documents.
     buffer: List[str] = []
     current_len = 0
     for para in paragraphs:
         para_len = len(para)
         if current_len and current_len + 1 + para_len > target_chars and current_len >= min_chars:
             yield " ".join(buffer)
-            overlap = buffer[-overlap_paras:]
-            buffer = overlap.copy()
-            current_len = len(" ".join(buffer)) if buffer else 0
+            buffer = buffer[-overlap_paras:]
+            current_len = sum(len(p) for p in buffer) + max(len(buffer) - 1, 0)
         buffer.append(para)
-        current_len = len(" ".join(buffer))
+        current_len = current_len + 1 + para_len if current_len else para_len
 
         while current_len > target_chars * 1.5:
             text = " ".join(buffer)
             midpoint = target_chars
             chunk = text[:midpoint]
             yield chunk.strip()
-            remainder = text[midpoint:]
-            buffer = [remainder.strip()] if remainder.strip() else []
-            current_len = len(" ".join(buffer)) if buffer else 0
+            remainder = text[midpoint:].strip()
+            buffer = [remainder] if remainder else []
+            current_len = len(remainder)
 
     if buffer:
         yield " ".join(buffer)
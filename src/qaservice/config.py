@@ -9,12 +9,21 @@ PROCESSED_DIR = DATA_DIR / "processed"
 INDEX_DIR = DATA_DIR / "index"
 SQLITE_DB = DATA_DIR / "sqlite" / "chunks.db"
 CHROMA_DIR = INDEX_DIR / "chroma"
+# Sidecar flat index used by the exact rerank stage, one file pair per
+# collection (rerank_fp16.<collection>.bin/.json): raw float16 vectors in
+# row order plus a JSON map from numeric chunk id to row.
+RERANK_FP16_STEM = "rerank_fp16"
 
 SOURCES_JSON = ROOT_DIR / "sources.json"
 QUESTIONS_JSONL = ROOT_DIR / "data" / "questions.jsonl"
 
 EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
-EMBED_BATCH_SIZE = 16
+# "auto" picks CUDA, then MPS, then CPU; set explicitly to pin a device.
+EMBED_DEVICE = "auto"
+EMBED_BATCH_SIZE = 64
+QUERY_CACHE_SIZE = 4096
+# Entries kept in the content-hash embedding cache shared across Chroma calls.
+EMBED_CACHE_SIZE = 50_000
 SEED = 42
 
 # Chunking parameters
@@ -25,6 +34,26 @@ MIN_CHUNK_CHAR = 200
 # Retrieval defaults
 VECTOR_TOP_K = 30
 LEXICAL_TOP_K = 30
+SEMANTIC_CACHE_SIZE = 512
+SEMANTIC_CACHE_THRESHOLD = 0.95
+# Skip the dense retriever in hybrid mode when the lexical top hit is both
+# strong in absolute BM25 terms and far ahead of the runner-up.
+EARLY_EXIT = True
+EARLY_EXIT_BM25_THRESHOLD = 15.0
+EARLY_EXIT_BM25_MARGIN = 2.0
+# Query terms appearing in fewer than this fraction of chunks are treated as
+# rare and intersected first when building the FTS match expression.
+RARE_TERM_DF_RATIO = 0.01
+# Store the in-memory dense index as int8 with per-vector scales (4x smaller,
+# faster memory-bound scoring); set False to keep exact float32 vectors.
+DENSE_INT8 = True
+
+# HNSW build/search parameters for the Chroma collection. search_ef is the
+# main recall/latency lever at query time; M and construction_ef trade index
+# build time and memory for graph quality.
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
 HYBRID_ALPHA = 0.7
 ANSWER_TOP_K = 4
 ABSTAIN_THRESHOLD = 0.28
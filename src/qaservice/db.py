@@ -4,12 +4,26 @@ from __future__ import annotations
 
 import json
 import sqlite3
+import threading
 from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 from typing import Iterable, List, Dict, Any
 
 from . import config
 
+# Applied once per connection; the search path opens the database on every
+# request, so connections are cached per thread instead of reopened.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+)
+
+_local = threading.local()
+
 SCHEMA_SQL = """
 PRAGMA journal_mode=WAL;
 CREATE TABLE IF NOT EXISTS sources (
@@ -38,21 +52,53 @@ CREATE VIRTUAL TABLE IF NOT EXISTS chunk_fts USING fts5(
     content='chunks',
     content_rowid='id'
 );
+
+CREATE VIRTUAL TABLE IF NOT EXISTS chunk_fts_vocab USING fts5vocab(chunk_fts, 'row');
 """
 
 
+def fetch_term_doc_freq(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Return document frequency per FTS term from the fts5vocab sidecar."""
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chunk_fts_vocab USING fts5vocab(chunk_fts, 'row')"
+    )
+    cursor = conn.execute("SELECT term, doc FROM chunk_fts_vocab")
+    return {row["term"]: row["doc"] for row in cursor.fetchall()}
+
+
+def count_chunks(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+
+def _open_connection(target: Path) -> sqlite3.Connection:
+    target.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(target, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
 @contextmanager
 def get_connection(db_path: Path | None = None):
-    """Context manager that yields a SQLite3 connection."""
+    """Context manager that yields a cached, per-thread SQLite3 connection.
+
+    Connections stay open across calls; the context exit commits any pending
+    writes but no longer tears the handle down, which removes the
+    open/parse-pragmas/close cost from every search request.
+    """
     target = db_path or config.SQLITE_DB
-    target.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(target)
+    cache: Dict[str, sqlite3.Connection] = getattr(_local, "connections", None)
+    if cache is None:
+        cache = _local.connections = {}
+    key = str(target)
+    conn = cache.get(key)
+    if conn is None:
+        conn = cache[key] = _open_connection(target)
     try:
-        conn.row_factory = sqlite3.Row
         yield conn
     finally:
         conn.commit()
-        conn.close()
 
 
 def initialise_database(conn: sqlite3.Connection) -> None:
@@ -82,29 +128,81 @@ def upsert_sources(conn: sqlite3.Connection, sources: List[Dict[str, str]]) -> N
 
 
 def insert_chunks(conn: sqlite3.Connection, chunk_rows: Iterable[Dict[str, Any]]) -> None:
-    """Bulk insert chunk rows and refresh the FTS index."""
-    conn.execute("DELETE FROM chunks")
-    conn.executemany(
+    """Bulk insert chunk rows and refresh the FTS index.
+
+    The delete, insert, and FTS rebuild run inside one explicit IMMEDIATE
+    transaction so the WAL is flushed once at commit instead of per
+    statement, and the index is repopulated with FTS5's single-pass
+    'rebuild' command rather than delete-all plus row-by-row inserts.
+    """
+    conn.commit()  # close any implicit transaction before taking the write lock
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM chunks")
+        conn.executemany(
+            """
+            INSERT INTO chunks (source_id, chunk_index, text, char_len, page_start, page_end)
+            VALUES (:source_id, :chunk_index, :text, :char_len, :page_start, :page_end)
+            """,
+            chunk_rows,
+        )
+        conn.execute("INSERT INTO chunk_fts(chunk_fts) VALUES('rebuild')")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def fetch_chunks_with_sources(conn: sqlite3.Connection, ids: Iterable[int]) -> List[sqlite3.Row]:
+    """Fetch chunk rows joined with their source metadata in one statement.
+
+    The candidate ids are passed as a JSON array and expanded with
+    ``json_each``, so the SQL text is constant regardless of how many ids
+    are requested and SQLite can reuse the prepared plan.
+    """
+    id_list = list(ids)
+    if not id_list:
+        return []
+    cursor = conn.execute(
         """
-        INSERT INTO chunks (source_id, chunk_index, text, char_len, page_start, page_end)
-        VALUES (:source_id, :chunk_index, :text, :char_len, :page_start, :page_end)
+        SELECT c.id, c.source_id, c.chunk_index, c.text, c.char_len,
+               c.page_start, c.page_end, s.title, s.url
+        FROM chunks c
+        JOIN sources s ON s.id = c.source_id
+        WHERE c.id IN (SELECT value FROM json_each(?))
         """,
-        chunk_rows,
+        (json.dumps(id_list),),
     )
-    conn.execute("INSERT INTO chunk_fts(chunk_fts) VALUES('delete-all')")
-    conn.execute(
-        "INSERT INTO chunk_fts(rowid, text) SELECT id, text FROM chunks"
+    return cursor.fetchall()
+
+
+# Parameter-count buckets for IN(...) queries. Padding the id list up to the
+# next bucket keeps the SQL text down to a handful of variants so SQLite's
+# per-connection statement cache can reuse the compiled plans.
+_IN_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+_IN_PAD_SENTINEL = -1  # never a valid rowid; padded slots match nothing
+
+
+def _bucketed_ids(ids: List[int]) -> List[int]:
+    for bucket in _IN_BUCKETS:
+        if len(ids) <= bucket:
+            return ids + [_IN_PAD_SENTINEL] * (bucket - len(ids))
+    return ids
+
+
+@lru_cache(maxsize=None)
+def _chunks_by_ids_sql(width: int) -> str:
+    return (
+        "SELECT id, source_id, chunk_index, text, char_len, page_start, page_end "
+        "FROM chunks WHERE id IN (%s)" % ",".join("?" * width)
     )
 
 
 def fetch_chunks_by_ids(conn: sqlite3.Connection, ids: List[int]) -> Dict[int, sqlite3.Row]:
     if not ids:
         return {}
-    cursor = conn.execute(
-        "SELECT id, source_id, chunk_index, text, char_len, page_start, page_end FROM chunks WHERE id IN (%s)" %
-        ",".join("?" for _ in ids),
-        ids,
-    )
+    params = _bucketed_ids(list(ids))
+    cursor = conn.execute(_chunks_by_ids_sql(len(params)), params)
     return {row["id"]: row for row in cursor.fetchall()}
 
 
@@ -3,10 +3,13 @@
 from __future__ import annotations
 
 import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Dict, Iterable, List
 
+import numpy as np
 import pypdf
 from tqdm import tqdm
 
@@ -37,6 +40,11 @@ class ChunkPayload:
         }
 
 
+def _extract_chunks(pdf_path: str, source_id: int) -> List[ChunkPayload]:
+    """Extract and chunk one PDF; module-level so it pickles across processes."""
+    return list(PdfIngestor._chunk_pdf(Path(pdf_path), source_id))
+
+
 class PdfIngestor:
     def __init__(self) -> None:
         self.vector_store = ChromaVectorStore()
@@ -54,14 +62,28 @@ class PdfIngestor:
                 logger.error("No sources found to ingest.")
                 return
 
-            all_chunks: List[ChunkPayload] = []
-            for file_name, resolved_path in tqdm(path_map.items(), desc="Chunking PDFs"):
+            tasks: List[tuple[str, int]] = []
+            for file_name, resolved_path in path_map.items():
                 source_id = file_to_source_id.get(file_name)
                 if source_id is None:
                     logger.warning("Skipping %s because it is missing in the sources table", file_name)
                     continue
-                chunks = list(self._chunk_pdf(resolved_path, source_id))
-                all_chunks.extend(chunks)
+                tasks.append((str(resolved_path), source_id))
+
+            # pypdf text extraction is CPU-bound and holds the GIL, so fan the
+            # files out across processes; map() keeps results in task order so
+            # chunk ids stay deterministic.
+            all_chunks: List[ChunkPayload] = []
+            if tasks:
+                max_workers = min(len(tasks), os.cpu_count() or 1)
+                with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                    paths, source_ids = zip(*tasks)
+                    for chunks in tqdm(
+                        pool.map(_extract_chunks, paths, source_ids),
+                        total=len(tasks),
+                        desc="Chunking PDFs",
+                    ):
+                        all_chunks.extend(chunks)
 
             logger.info("Chunked %d pieces from %d PDFs", len(all_chunks), len(path_map))
 
@@ -72,7 +94,7 @@ class PdfIngestor:
             ).fetchall()
 
         self.vector_store.reset()
-        ids = [f"chunk-{row['id']}" for row in rows]
+        ids = np.fromiter((row["id"] for row in rows), dtype=np.uint64, count=len(rows))
         documents = [row["text"] for row in rows]
         metadata = [
             {
@@ -85,8 +107,16 @@ class PdfIngestor:
             for row in rows
         ]
 
+        logger.info("Embedding %d chunks in batches of %d", len(ids), config.EMBED_BATCH_SIZE)
+        embeddings = self.vector_store.model.embed(
+            documents,
+            batch_size=config.EMBED_BATCH_SIZE,
+            show_progress_bar=True,
+        )
+
         logger.info("Indexing %d chunks in Chroma", len(ids))
-        self.vector_store.add(ids=ids, documents=documents, metadatas=metadata)
+        self.vector_store.add(ids=ids, documents=documents, metadatas=metadata, embeddings=embeddings)
+        self.vector_store.flush()
         logger.info("Ingestion complete")
 
     @staticmethod
@@ -113,7 +143,12 @@ class PdfIngestor:
 
     @staticmethod
     def _chunk_pdf(pdf_path: Path, source_id: int) -> Iterable[ChunkPayload]:
-        reader = pypdf.PdfReader(str(pdf_path))
+        with open(pdf_path, "rb", buffering=1 << 20) as handle:
+            reader = pypdf.PdfReader(handle)
+            yield from PdfIngestor._chunk_pages(reader, source_id)
+
+    @staticmethod
+    def _chunk_pages(reader: pypdf.PdfReader, source_id: int) -> Iterable[ChunkPayload]:
         chunk_index = 0
         buffer: List[str] = []
         buffer_start_page: int | None = None
@@ -5,18 +5,27 @@ from __future__ import annotations
 import math
 import re
 from dataclasses import dataclass
-from typing import Dict, Iterable, List, Optional
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
 
 from . import config, db
 from .vectorstore import ChromaVectorStore
 
 TOKEN_RE = re.compile(r"[A-Za-z0-9_]{2,}")
 
-STOP_WORDS = {
+STOP_WORDS = frozenset({
     'the','and','for','with','that','from','this','into','about','what','when','where','how','does','should','are','was','were','have','has','will','would','can','could','may','might','which','using','according','please','provide','explain','describe','does','do','at','of','in','to','on','by','or','an','any','be','a','as','is','it','their','there','who','whom'
-}
+})
+
 
-@dataclass
+@lru_cache(maxsize=config.QUERY_CACHE_SIZE)
+def _query_tokens(query: str) -> Tuple[str, ...]:
+    """Tokenize and stopword-filter a query, memoized for repeat questions."""
+    return tuple(tok for tok in TOKEN_RE.findall(query.lower()) if tok not in STOP_WORDS)
+
+@dataclass(slots=True)
 class SearchResult:
     chunk_id: int
     source_id: int
@@ -34,97 +43,218 @@ class SearchResult:
 class SafetySearchEngine:
     def __init__(self) -> None:
         self.vector_store = ChromaVectorStore()
+        self._dense_ids: Optional[np.ndarray] = None
+        self._dense_matrix: Optional[np.ndarray] = None
+        self._dense_scale: Optional[np.ndarray] = None
+        self._term_doc_freq: Optional[Dict[str, int]] = None
+        self._chunk_count: int = 0
+
+    def warmup(self) -> None:
+        """Pre-build everything the request path lazy-loads.
+
+        Serving answers needs the in-memory dense matrix and the FTS term
+        statistics, not just a warm model, so both are forced here along
+        with the vector-store warmup.
+        """
+        self.vector_store.warmup()
+        self._dense_index()
+        self._term_stats()
+
+    def _dense_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Load all chunk embeddings into a flat in-memory matrix.
+
+        The corpus is small enough (~2.3k x 384 dims) that an exact
+        dot-product over a contiguous matrix beats a round-trip through
+        Chroma's HNSW query API per request. With DENSE_INT8 the matrix is
+        stored quantized alongside per-vector dequantization scales.
+        """
+        if self._dense_matrix is None:
+            ids, embeddings = self.vector_store.export_vectors()
+            self._dense_ids = np.asarray(ids, dtype=np.int64)
+            matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+            if config.DENSE_INT8 and matrix.size:
+                # Symmetric per-vector quantization: q = round(x/scale) with
+                # scale = max|x|/127; scoring multiplies the scale back in, so
+                # ranking error stays within int8 rounding noise.
+                scale = np.abs(matrix).max(axis=1) / 127.0
+                scale = np.maximum(scale, 1e-12).astype(np.float32)
+                matrix = np.round(matrix / scale[:, None]).astype(np.int8)
+                self._dense_scale = scale
+            self._dense_matrix = matrix
+        return self._dense_ids, self._dense_matrix
 
     @staticmethod
     def _normalize(scores: Dict[int, float]) -> Dict[int, float]:
         if not scores:
             return {}
-        values = list(scores.values())
-        if len(set(values)) == 1:
-            return {key: 1.0 for key in scores}
-        min_score = min(values)
-        max_score = max(values)
-        span = max_score - min_score
-        return {key: (value - min_score) / span for key, value in scores.items()}
-
-    def _build_results(self, rows, source_map, score_map, vector_map=None, keyword_map=None) -> List[SearchResult]:
+        values = np.fromiter(scores.values(), dtype=np.float32, count=len(scores))
+        lo = float(values.min())
+        hi = float(values.max())
+        if hi == lo:
+            return dict.fromkeys(scores, 1.0)
+        normalized = (values - lo) / (hi - lo)
+        return dict(zip(scores.keys(), normalized.tolist()))
+
+    def _build_results(self, rows, score_map, vector_map=None, keyword_map=None) -> List[SearchResult]:
+        if not rows:
+            return []
+        # Sort on a bare float array instead of dataclass attributes, then
+        # materialize results directly in rank order.
+        scores = np.fromiter(
+            (score_map.get(row["id"], 0.0) for row in rows),
+            dtype=np.float64,
+            count=len(rows),
+        )
+        order = np.argsort(-scores, kind="stable")
+        vector_map = vector_map or {}
+        keyword_map = keyword_map or {}
         results: List[SearchResult] = []
-        for row in rows:
-            src = source_map[row["source_id"]]
+        for idx in order:
+            row = rows[idx]
             results.append(
                 SearchResult(
                     chunk_id=row["id"],
                     source_id=row["source_id"],
                     chunk_index=row["chunk_index"],
                     text=row["text"],
-                    score=score_map.get(row["id"], 0.0),
-                    vector_score=(vector_map or {}).get(row["id"]),
-                    keyword_score=(keyword_map or {}).get(row["id"]),
+                    score=float(scores[idx]),
+                    vector_score=vector_map.get(row["id"]),
+                    keyword_score=keyword_map.get(row["id"]),
                     page_start=row["page_start"],
                     page_end=row["page_end"],
-                    source_title=src["title"],
-                    source_url=src["url"],
+                    source_title=row["title"],
+                    source_url=row["url"],
                 )
             )
-        results.sort(key=lambda r: r.score, reverse=True)
         return results
 
-    def vector_search(self, query: str, top_k: int) -> List[SearchResult]:
-        response = self.vector_store.query(query, n_results=top_k)
-        ids = response.get("ids", [[]])[0]
-        distances = response.get("distances", [[]])[0]
-        if not ids:
+    def vector_search(
+        self, query: str, top_k: int, query_embedding: Optional[np.ndarray] = None
+    ) -> List[SearchResult]:
+        dense_ids, matrix = self._dense_index()
+        if matrix.size == 0:
             return []
-        chunk_ids = [int(identifier.split("-")[1]) for identifier in ids]
+        query_emb = (
+            query_embedding
+            if query_embedding is not None
+            else self.vector_store.model.embed_query(query)
+        )
+        # Embeddings are normalized, so the dot product is cosine similarity.
+        scores = matrix @ query_emb
+        if self._dense_scale is not None:
+            scores = scores * self._dense_scale
+        top_k = min(top_k, scores.shape[0])
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        chunk_ids = [int(chunk_id) for chunk_id in dense_ids[top]]
         similarity_scores = {
-            chunk_id: 1 - dist if dist is not None else 0.0
-            for chunk_id, dist in zip(chunk_ids, distances)
+            chunk_id: float(score)
+            for chunk_id, score in zip(chunk_ids, scores[top])
         }
 
         with db.get_connection() as conn:
-            rows = conn.execute(
-                "SELECT id, source_id, chunk_index, text, page_start, page_end FROM chunks WHERE id IN (%s)" %
-                ",".join("?" for _ in chunk_ids),
-                chunk_ids,
-            ).fetchall()
-            source_map = db.fetch_source_map(conn)
+            rows = db.fetch_chunks_with_sources(conn, chunk_ids)
 
-        return self._build_results(rows, source_map, similarity_scores, vector_map=similarity_scores)
+        return self._build_results(rows, similarity_scores, vector_map=similarity_scores)
 
-    def lexical_search(self, query: str, top_k: int) -> List[SearchResult]:
-        tokens = [tok for tok in TOKEN_RE.findall(query.lower()) if tok not in STOP_WORDS]
-        if not tokens:
-            return []
-        fts_query = " OR ".join(tokens)
-        bm25_scores: Dict[int, float] = {}
-        rows = []
+    def _term_stats(self) -> Tuple[Dict[str, int], int]:
+        """Load per-term document frequencies once for match-expression planning."""
+        if self._term_doc_freq is None:
+            with db.get_connection() as conn:
+                self._term_doc_freq = db.fetch_term_doc_freq(conn)
+                self._chunk_count = db.count_chunks(conn)
+        return self._term_doc_freq, self._chunk_count
+
+    def _fts_match_expression(self, tokens: Tuple[str, ...]) -> str:
+        """Build a MATCH expression that intersects rare terms first.
+
+        Rare terms (low document frequency) have short posting lists, so
+        AND-ing them up front lets FTS5 prune before touching the long
+        postings of common terms, which stay in an OR group. Falls back to
+        plain OR when the query has no usably rare term.
+        """
+        doc_freq, total = self._term_stats()
+        threshold = max(1.0, total * config.RARE_TERM_DF_RATIO)
+        rare = [tok for tok in tokens if 0 < doc_freq.get(tok, 0) <= threshold]
+        common = [tok for tok in tokens if tok not in rare]
+        if rare and common:
+            return '{} AND ({})'.format(
+                " AND ".join(f'"{tok}"' for tok in rare),
+                " OR ".join(f'"{tok}"' for tok in common),
+            )
+        return " OR ".join(f'"{tok}"' for tok in tokens)
+
+    def _run_fts(self, fts_query: str, top_k: int) -> List:
         with db.get_connection() as conn:
             cursor = conn.execute(
                 """
                 SELECT chunks.id, chunks.source_id, chunks.chunk_index, chunks.text, chunks.page_start, chunks.page_end,
+                       sources.title, sources.url,
                        bm25(chunk_fts) AS bm25_score
                 FROM chunk_fts
                 JOIN chunks ON chunk_fts.rowid = chunks.id
+                JOIN sources ON sources.id = chunks.source_id
                 WHERE chunk_fts MATCH ?
                 ORDER BY bm25_score ASC
                 LIMIT ?
                 """,
                 (fts_query, top_k),
             )
-            rows = cursor.fetchall()
-            source_map = db.fetch_source_map(conn)
+            return cursor.fetchall()
 
+    def lexical_search(self, query: str, top_k: int) -> List[SearchResult]:
+        tokens = _query_tokens(query)
+        if not tokens:
+            return []
+        fts_query = self._fts_match_expression(tokens)
+        rows = self._run_fts(fts_query, top_k)
+        if not rows and " AND " in fts_query:
+            # The rare-term intersection can be too strict; retry as plain OR.
+            rows = self._run_fts(" OR ".join(f'"{tok}"' for tok in tokens), top_k)
+
+        bm25_scores: Dict[int, float] = {}
         for row in rows:
             raw_score = row["bm25_score"]
             if raw_score is None or math.isinf(raw_score):
                 continue
             bm25_scores[row["id"]] = -raw_score
 
-        return self._build_results(rows, source_map, bm25_scores, keyword_map=bm25_scores)
+        return self._build_results(rows, bm25_scores, keyword_map=bm25_scores)
 
-    def hybrid_search(self, query: str, top_k: int, alpha: float = config.HYBRID_ALPHA) -> List[SearchResult]:
-        vector_candidates = self.vector_search(query, config.VECTOR_TOP_K)
+    @staticmethod
+    def _lexical_is_decisive(candidates: List[SearchResult]) -> bool:
+        """True when the top BM25 hit is strong and far ahead of the rest."""
+        if not candidates:
+            return False
+        top = candidates[0].keyword_score or 0.0
+        if top < config.EARLY_EXIT_BM25_THRESHOLD:
+            return False
+        if len(candidates) == 1:
+            return True
+        second = candidates[1].keyword_score or 0.0
+        return top >= config.EARLY_EXIT_BM25_MARGIN * max(second, 1e-9)
+
+    def hybrid_search(
+        self,
+        query: str,
+        top_k: int,
+        alpha: float = config.HYBRID_ALPHA,
+        query_embedding: Optional[np.ndarray] = None,
+    ) -> List[SearchResult]:
+        # Lexical search is a pure-SQLite lookup and much cheaper than the
+        # dense path, so run it first and skip the vector retriever entirely
+        # when the keyword evidence is unambiguous.
         lexical_candidates = self.lexical_search(query, config.LEXICAL_TOP_K)
+        if config.EARLY_EXIT and self._lexical_is_decisive(lexical_candidates):
+            keyword_scores = {res.chunk_id: res.keyword_score or 0.0 for res in lexical_candidates}
+            norm_keyword = self._normalize(keyword_scores)
+            results = lexical_candidates[:top_k]
+            for res in results:
+                res.score = norm_keyword.get(res.chunk_id, 0.0)
+            return results
+
+        vector_candidates = self.vector_search(
+            query, config.VECTOR_TOP_K, query_embedding=query_embedding
+        )
 
         vector_scores = {res.chunk_id: res.vector_score or 0.0 for res in vector_candidates}
         keyword_scores = {res.chunk_id: res.keyword_score or 0.0 for res in lexical_candidates}
@@ -137,12 +267,7 @@ class SafetySearchEngine:
             return []
 
         with db.get_connection() as conn:
-            rows = conn.execute(
-                "SELECT id, source_id, chunk_index, text, page_start, page_end FROM chunks WHERE id IN (%s)" %
-                ",".join("?" for _ in all_ids),
-                list(all_ids),
-            ).fetchall()
-            source_map = db.fetch_source_map(conn)
+            rows = db.fetch_chunks_with_sources(conn, all_ids)
 
         combined_scores = {
             chunk_id: alpha * norm_vector.get(chunk_id, 0.0) + (1 - alpha) * norm_keyword.get(chunk_id, 0.0)
@@ -150,15 +275,20 @@ class SafetySearchEngine:
         }
         return self._build_results(
             rows,
-            source_map,
             combined_scores,
             vector_map=vector_scores,
             keyword_map=keyword_scores,
         )[:top_k]
 
-    def search(self, query: str, k: int, mode: str) -> List[SearchResult]:
+    def search(
+        self,
+        query: str,
+        k: int,
+        mode: str,
+        query_embedding: Optional[np.ndarray] = None,
+    ) -> List[SearchResult]:
         if mode == "baseline":
-            return self.vector_search(query, k)
+            return self.vector_search(query, k, query_embedding=query_embedding)
         if mode == "hybrid":
-            return self.hybrid_search(query, k)
+            return self.hybrid_search(query, k, query_embedding=query_embedding)
         raise ValueError("mode must be 'baseline' or 'hybrid'")
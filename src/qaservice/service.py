@@ -2,27 +2,68 @@
 """High-level question answering service."""
 from __future__ import annotations
 
-from typing import Dict
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+import numpy as np
 
 from . import config
 from .answers import build_answer
 from .search import SafetySearchEngine
 
+# (query embedding, k, mode, payload) for each cached answer.
+_CacheEntry = Tuple[np.ndarray, int, str, Dict[str, object]]
+
 
 class QAService:
     def __init__(self) -> None:
         self.engine = SafetySearchEngine()
+        self._cache: Deque[_CacheEntry] = deque(maxlen=config.SEMANTIC_CACHE_SIZE)
+        self._cache_lock = threading.Lock()
+
+    def warmup(self) -> None:
+        """Pre-warm the embedding model and search structures before traffic."""
+        self.engine.warmup()
+
+    def _cache_lookup(self, query_emb: np.ndarray, k: int, mode: str) -> Optional[Dict[str, object]]:
+        """Return a cached payload whose question is semantically close enough.
+
+        Embeddings are normalized, so one matmul over the stacked cache gives
+        cosine similarity against every stored question at once.
+        """
+        with self._cache_lock:
+            candidates = [entry for entry in self._cache if entry[1] == k and entry[2] == mode]
+            if not candidates:
+                return None
+            scores = np.stack([entry[0] for entry in candidates]) @ query_emb
+            best = int(np.argmax(scores))
+            if float(scores[best]) >= config.SEMANTIC_CACHE_THRESHOLD:
+                return candidates[best][3]
+        return None
+
+    def _cache_store(self, query_emb: np.ndarray, k: int, mode: str, payload: Dict[str, object]) -> None:
+        with self._cache_lock:
+            self._cache.appendleft((query_emb, k, mode, payload))
 
     def ask(self, question: str, k: int, mode: str) -> Dict[str, object]:
         k = max(1, min(k, 20))
         mode = mode or "hybrid"
         mode = mode.lower()
-        results = self.engine.search(question, k, mode)
+        query_emb = self.engine.vector_store.model.embed_query(question)
+
+        cached = self._cache_lookup(query_emb, k, mode)
+        if cached is not None:
+            return {**cached, "question": question}
+
+        results = self.engine.search(question, k, mode, query_embedding=query_emb)
         answer, contexts = build_answer(question, results)
-        return {
+        payload = {
             "question": question,
             "answer": answer,
             "contexts": contexts,
             "reranker_used": mode == "hybrid",
             "mode": mode,
         }
+        self._cache_store(query_emb, k, mode, payload)
+        return payload
@@ -2,68 +2,439 @@
 """Wrapper around Chroma vector store."""
 from __future__ import annotations
 
-from typing import Iterable, List, Sequence
+import hashlib
+import json
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Iterable, List, Sequence
 
 import chromadb
+import numpy as np
 from chromadb.api.models.Collection import Collection
 
 from . import config
+from ._rerank import topk_cosine
 from .embedding import EmbeddingModel
 
 
+def _content_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def _id_number(identifier: str) -> int:
+    """Numeric part of a ``chunk-<rowid>`` Chroma id."""
+    return int(identifier.rsplit("-", 1)[1])
+
+
+@lru_cache(maxsize=None)
+def _get_model() -> EmbeddingModel:
+    return EmbeddingModel()
+
+
+@lru_cache(maxsize=None)
+def _get_client(path: str) -> chromadb.PersistentClient:
+    return chromadb.PersistentClient(path=path)
+
+
+def _collection_metadata() -> dict:
+    """HNSW settings applied when a collection is (re)created."""
+    return {
+        "hnsw:space": "ip",
+        "hnsw:M": config.HNSW_M,
+        "hnsw:construction_ef": config.HNSW_EF_CONSTRUCTION,
+        "hnsw:search_ef": config.HNSW_EF_SEARCH,
+    }
+
+
 class _EmbeddingFunction:
-    """Embedding function compatible with the Chroma interface."""
+    """Embedding function compatible with the Chroma interface.
+
+    Results are cached by content hash so identical strings — repeated
+    queries or duplicated chunk text, within a batch or across calls — are
+    embedded only once. Chroma may invoke this from worker threads, so cache
+    mutations are guarded by a lock.
+    """
 
     def __init__(self, model: EmbeddingModel) -> None:
         self.model = model
+        self._cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
 
-    def _ensure_list(self, input: Iterable[str] | str) -> List[str]:
+    def _normalize(self, input: Iterable[str] | str) -> tuple[List[str], bool]:
+        """Return ``(texts, scalar)`` with the type checked exactly once."""
         if isinstance(input, str):
-            return [input]
-        return list(input)
+            return [input], True
+        # Chroma usually hands us a list already; avoid an O(N) copy then.
+        return (input if isinstance(input, list) else list(input)), False
+
+    def _embed_cached(self, texts: List[str]) -> List[np.ndarray]:
+        """Embed texts through the cache, keeping rows as float32 arrays.
+
+        Cached rows stay ndarray so the cache holds compact packed floats;
+        conversion to nested lists happens only at the Chroma boundary.
+        """
+        keys = [_content_key(text) for text in texts]
+        output: List[np.ndarray | None] = [None] * len(texts)
+        misses: Dict[bytes, List[int]] = {}
+        with self._cache_lock:
+            for position, key in enumerate(keys):
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    output[position] = cached
+                else:
+                    misses.setdefault(key, []).append(position)
+        if misses:
+            unique_keys = list(misses)
+            to_embed = [texts[misses[key][0]] for key in unique_keys]
+            embeddings = self.model.embed(to_embed)
+            with self._cache_lock:
+                for key, embedding in zip(unique_keys, embeddings):
+                    self._cache[key] = embedding
+                    self._cache.move_to_end(key)
+                    for position in misses[key]:
+                        output[position] = embedding
+                while len(self._cache) > config.EMBED_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        return output
 
     def __call__(self, input: Sequence[str]) -> List[List[float]]:  # pragma: no cover - chroma interface
-        return self.model.embed(self._ensure_list(input))
+        return [row.tolist() for row in self._embed_cached(self._normalize(input)[0])]
 
     def embed_documents(self, input: Sequence[str]) -> List[List[float]]:  # pragma: no cover
-        return self.model.embed(self._ensure_list(input))
+        return [row.tolist() for row in self._embed_cached(self._normalize(input)[0])]
 
     def embed_query(self, input: str | Sequence[str]) -> List[float] | List[List[float]]:  # pragma: no cover
-        prepared = self._ensure_list(input)
-        embeddings = self.model.embed(prepared)
-        if isinstance(input, str):
-            return embeddings[0]
-        return embeddings
+        texts, scalar = self._normalize(input)
+        embeddings = self._embed_cached(texts)
+        if scalar:
+            return embeddings[0].tolist()
+        return [row.tolist() for row in embeddings]
 
     def name(self) -> str:  # pragma: no cover - chroma interface
         return self.model.model_name
 
 
+class _BatchEmbedFn(_EmbeddingFunction):
+    """Variant registered with Chroma, which always invokes us with a list.
+
+    Dropping the scalar/iterable classification from ``__call__`` removes
+    the per-invocation type checks from the steady state; the multi-path
+    base class stays available for callers that want the convenience API.
+    """
+
+    def __call__(self, input: List[str]) -> List[List[float]]:  # pragma: no cover - chroma interface
+        return [row.tolist() for row in self._embed_cached(input)]
+
+
+class _Fp16Sidecar:
+    """Flat float16 copy of the stored vectors, kept next to Chroma.
+
+    The rerank stage needs raw candidate vectors; fetching them back through
+    Chroma per query marshals d-dim Python lists. The sidecar appends each
+    batch as packed float16 and is memory-mapped on read, so rerank gathers
+    rows straight from page cache at 2 bytes per dimension. Ids are kept as
+    a uint64 array rather than Python strings, so the hot-path lookup is a
+    vectorized searchsorted instead of per-id dict probes.
+
+    The file pair is keyed by collection name so stores over different
+    collections never share (or cross-serve) vectors for the same rowid.
+    """
+
+    def __init__(self, collection_name: str) -> None:
+        self._path = config.INDEX_DIR / f"{config.RERANK_FP16_STEM}.{collection_name}.bin"
+        self._map_path = config.INDEX_DIR / f"{config.RERANK_FP16_STEM}.{collection_name}.json"
+        self._lock = threading.Lock()
+        self._ids: np.ndarray | None = None
+        self._sorter: np.ndarray | None = None
+        self._matrix: np.ndarray | None = None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._path.unlink(missing_ok=True)
+            self._map_path.unlink(missing_ok=True)
+            self._ids = None
+            self._sorter = None
+            self._matrix = None
+
+    def append(self, ids: "np.ndarray | Sequence[str]", embeddings: np.ndarray) -> None:
+        if not embeddings.size:
+            return
+        if not isinstance(ids, np.ndarray):
+            ids = np.fromiter((_id_number(identifier) for identifier in ids), dtype=np.uint64, count=len(ids))
+        with self._lock:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            if self._map_path.exists():
+                mapping = json.loads(self._map_path.read_text())
+            else:
+                mapping = {"dim": int(embeddings.shape[1]), "ids": []}
+            with open(self._path, "ab") as handle:
+                handle.write(np.ascontiguousarray(embeddings, dtype=np.float16).tobytes())
+            mapping["ids"].extend(int(number) for number in ids)
+            self._map_path.write_text(json.dumps(mapping))
+            self._ids = None
+            self._sorter = None
+            self._matrix = None
+
+    def _load(self) -> bool:
+        if self._matrix is not None:
+            return True
+        if not (self._path.exists() and self._map_path.exists()):
+            return False
+        mapping = json.loads(self._map_path.read_text())
+        matrix = np.memmap(self._path, dtype=np.float16, mode="r")
+        self._matrix = matrix.reshape(-1, mapping["dim"])
+        self._ids = np.asarray(mapping["ids"], dtype=np.uint64)
+        self._sorter = np.argsort(self._ids)
+        return True
+
+    def available(self) -> bool:
+        with self._lock:
+            return self._load()
+
+    def rows(self, ids: Sequence[str]) -> np.ndarray | None:
+        """Gather the vectors for ``ids`` as float32, or None on any miss."""
+        with self._lock:
+            if not self._load():
+                return None
+            wanted = np.fromiter((_id_number(identifier) for identifier in ids), dtype=np.uint64, count=len(ids))
+            slots = np.searchsorted(self._ids, wanted, sorter=self._sorter)
+            if slots.size and slots.max() >= self._ids.size:
+                return None
+            rows = self._sorter[slots]
+            if not np.array_equal(self._ids[rows], wanted):
+                return None
+            return self._matrix[rows].astype(np.float32)
+
+
 class ChromaVectorStore:
     def __init__(self, collection_name: str = "safety_chunks") -> None:
-        self.model = EmbeddingModel()
-        self.client = chromadb.PersistentClient(path=str(config.CHROMA_DIR))
+        # Model and client are memoized at module level so every store
+        # instance in the process shares one copy of each.
+        self.model = _get_model()
+        self.client = _get_client(str(config.CHROMA_DIR))
         self.collection_name = collection_name
+        self._embedding_fn = _BatchEmbedFn(self.model)
+        self._sidecar = _Fp16Sidecar(collection_name)
+        # Single writer thread: collection.add persists synchronously, so
+        # queueing writes lets the caller keep embedding batch N+1 while
+        # batch N is being flushed to disk.
+        self._write_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chroma-write")
+        self._inflight: "deque[Future]" = deque()
         self.collection: Collection = self.client.get_or_create_collection(
             name=self.collection_name,
-            embedding_function=_EmbeddingFunction(self.model),
-            metadata={"hnsw:space": "cosine"},
+            embedding_function=self._embedding_fn,
+            metadata=_collection_metadata(),
         )
 
+    @classmethod
+    def reset_cache(cls) -> None:
+        """Drop the memoized model/client; mainly for tests."""
+        _get_model.cache_clear()
+        _get_client.cache_clear()
+
     def reset(self) -> None:
         """Delete and recreate the collection."""
-        try:
+        self.flush()
+        existing = {collection.name for collection in self.client.list_collections()}
+        if self.collection_name in existing:
             self.client.delete_collection(self.collection_name)
-        except chromadb.errors.InvalidCollectionError:
-            pass
+        self._sidecar.clear()
         self.collection = self.client.get_or_create_collection(
             name=self.collection_name,
-            embedding_function=_EmbeddingFunction(self.model),
-            metadata={"hnsw:space": "cosine"},
+            embedding_function=self._embedding_fn,
+            metadata=_collection_metadata(),
+        )
+
+    def _add_batch(
+        self,
+        ids: "np.ndarray | List[str]",
+        documents: List[str],
+        metadatas: List[dict],
+        embeddings: np.ndarray,
+    ) -> None:
+        if embeddings.size:
+            # Symmetric int8 scale (max|x|/127) per vector, stored alongside
+            # the metadata so quantized consumers can dequantize without
+            # re-reading the full-precision vectors.
+            alphas = np.abs(embeddings).max(axis=1) / 127.0
+            for meta, alpha in zip(metadatas, alphas):
+                meta["sq_alpha"] = float(alpha)
+            self._sidecar.append(ids, embeddings)
+        if isinstance(ids, np.ndarray):
+            # Chroma requires string ids; materialize the chunk-<rowid>
+            # strings per batch so they stay short-lived.
+            ids = [f"chunk-{number}" for number in ids]
+        self.collection.add(
+            ids=ids,
+            documents=documents,
+            metadatas=metadatas,
+            embeddings=embeddings,
+        )
+
+    def add(
+        self,
+        ids: "np.ndarray | Sequence[str]",
+        documents: Sequence[str],
+        metadatas: Sequence[dict],
+        embeddings: "np.ndarray | Sequence[Sequence[float]] | None" = None,
+        batch_size: int = 256,
+        max_inflight: int = 4,
+    ) -> None:
+        """Add documents in micro-batches, overlapping embedding and writes.
+
+        ``ids`` may be a uint64 array of chunk rowids — preferred for large
+        ingests, since one packed array replaces len(ids) string objects —
+        or the equivalent ``chunk-<rowid>`` strings.
+
+        Without precomputed embeddings, up to ``max_inflight`` slices are
+        being encoded on a thread pool while earlier slices are written to
+        the collection, so the HNSW insert no longer blocks the encoder.
+        """
+        if not isinstance(ids, (list, np.ndarray)):
+            ids = list(ids)
+        documents = documents if isinstance(documents, list) else list(documents)
+        metadatas = metadatas if isinstance(metadatas, list) else list(metadatas)
+
+        if embeddings is not None:
+            if not isinstance(embeddings, np.ndarray):
+                embeddings = np.asarray(embeddings, dtype=np.float32)
+            for start in range(0, len(ids), batch_size):
+                end = start + batch_size
+                self._submit_write(ids[start:end], documents[start:end], metadatas[start:end], embeddings[start:end])
+            return
+
+        with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+            pending = deque()
+            for start in range(0, len(ids), batch_size):
+                end = start + batch_size
+                pending.append((start, end, pool.submit(self.model.embed, documents[start:end])))
+                if len(pending) >= max_inflight:
+                    first, last, future = pending.popleft()
+                    self._submit_write(ids[first:last], documents[first:last], metadatas[first:last], future.result())
+            while pending:
+                first, last, future = pending.popleft()
+                self._submit_write(ids[first:last], documents[first:last], metadatas[first:last], future.result())
+
+    def _submit_write(
+        self,
+        ids: "np.ndarray | List[str]",
+        documents: List[str],
+        metadatas: List[dict],
+        embeddings: np.ndarray,
+    ) -> None:
+        """Queue a batch on the writer thread, blocking when two are pending.
+
+        The cap keeps at most a couple of batches buffered in memory while
+        still overlapping embedding with persistence; waiting on the oldest
+        future also surfaces any write error to the caller.
+        """
+        while len(self._inflight) >= 2:
+            self._inflight.popleft().result()
+        self._inflight.append(self._write_pool.submit(self._add_batch, ids, documents, metadatas, embeddings))
+
+    def flush(self) -> None:
+        """Block until every queued write has been persisted."""
+        while self._inflight:
+            self._inflight.popleft().result()
+
+    def warmup(self) -> None:
+        """Touch the cold paths once so the first request doesn't pay them.
+
+        Runs a throwaway embed (loads model weights, fills kernel caches)
+        and a single index probe (faults in the HNSW mmap pages). Best
+        effort: a failure here only means the first real query stays cold.
+        """
+        try:
+            vector = self.model.embed(["warmup"])[0]
+            self.collection.query(query_embeddings=[vector], n_results=1, include=["distances"])
+        except Exception:  # pragma: no cover - warmup must never block startup
+            pass
+
+    def query(self, query: str, n_results: int, rerank: bool = True) -> dict:
+        """Two-phase query: oversample on the HNSW, rerank exactly, trim.
+
+        The approximate index supplies a candidate pool a few times larger
+        than requested, then the shortlist is rescored with exact cosine
+        against the raw vectors so the returned top-k does not inherit HNSW
+        approximation error. ``rerank=False`` skips the second phase and
+        returns the HNSW ordering as-is.
+        """
+        # Cheap prefilter before any model work: empty or whitespace-only
+        # queries never reach the encoder or the index.
+        if not query.strip():
+            return {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+        # embed_query normalizes whitespace/case and is LRU-cached, so
+        # repeated queries skip the forward pass; passing the vector here
+        # bypasses Chroma's embedding_function entirely.
+        query_emb = self.model.embed_query(query)
+        # Keep the payload minimal: marshalling d-dim embedding lists out of
+        # Chroma dominates response size, so they are requested only when the
+        # rerank needs them and the fp16 sidecar cannot serve the vectors.
+        include = ["documents", "metadatas", "distances"]
+        if rerank and not self._sidecar.available():
+            include.append("embeddings")
+        k_candidates = max(3 * n_results, n_results + 20) if rerank else n_results
+        response = self.collection.query(
+            query_embeddings=[query_emb],
+            n_results=k_candidates,
+            include=include,
         )
+        if not rerank:
+            return response
+        ids = response.get("ids", [[]])[0]
+        if len(ids) <= n_results:
+            return response
+        # Prefer the fp16 sidecar for candidate vectors; fall back to the
+        # fp32 lists Chroma returned when the sidecar is absent or stale.
+        candidate_matrix = self._sidecar.rows(ids)
+        if candidate_matrix is None:
+            embeddings = response.get("embeddings")
+            if embeddings is None:
+                # The sidecar looked usable so embeddings were not requested,
+                # yet the gather missed a candidate (stale after a partial
+                # ingest). Re-query with embeddings so the rerank still runs.
+                response = self.collection.query(
+                    query_embeddings=[query_emb],
+                    n_results=k_candidates,
+                    include=include + ["embeddings"],
+                )
+                ids = response.get("ids", [[]])[0]
+                embeddings = response.get("embeddings")
+            if embeddings is None:
+                # No vectors to rescore with; keep the HNSW ordering but
+                # still honor the requested result count.
+                return self._trim(response, n_results)
+            candidate_matrix = np.asarray(embeddings[0], dtype=np.float32)
+        order, scores = topk_cosine(query_emb, candidate_matrix, n_results)
+        trimmed: dict = {"ids": [[ids[i] for i in order]]}
+        trimmed["distances"] = [(1.0 - scores).tolist()]
+        for key in ("documents", "metadatas"):
+            column = response.get(key)
+            if column:
+                trimmed[key] = [[column[0][i] for i in order]]
+        return trimmed
+
+    @staticmethod
+    def _trim(response: dict, n_results: int) -> dict:
+        """Clamp every column of an oversampled query response to n_results."""
+        trimmed = dict(response)
+        for key, column in response.items():
+            # Result columns are nested one list per query; leave flat
+            # bookkeeping entries like "included" alone.
+            if isinstance(column, list) and column and isinstance(column[0], (list, np.ndarray)):
+                trimmed[key] = [column[0][:n_results]]
+        return trimmed
 
-    def add(self, ids: Sequence[str], documents: Sequence[str], metadatas: Sequence[dict]) -> None:
-        self.collection.add(ids=list(ids), documents=list(documents), metadatas=list(metadatas))
+    def export_vectors(self) -> tuple[List[int], List[List[float]]]:
+        """Return every stored (chunk_id, embedding) pair.
 
-    def query(self, query: str, n_results: int) -> dict:
-        return self.collection.query(query_texts=[query], n_results=n_results)
+        Used to build the in-memory flat index at search-engine startup; the
+        Chroma ids follow the ``chunk-<rowid>`` convention set at ingest.
+        """
+        payload = self.collection.get(include=["embeddings"])
+        ids = [_id_number(identifier) for identifier in payload.get("ids", [])]
+        embeddings = payload.get("embeddings")
+        return ids, list(embeddings) if embeddings is not None else []